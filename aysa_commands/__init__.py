@@ -18,58 +18,50 @@ __email__ = 'alejandro.bernardis@gmail.com'
 __license__ = 'MTI License, Version 2.0'
 __copyright__ = 'Copyright 2019-% {}'.format(__author__)
 
-try:
-    import sys
+# import's
+from aysa_commands._common import Command
 
-    if 'concurrency' in sys.modules:
-        del sys.modules['concurrency']
 
-    # import's
-    from aysa_commands._common import Command
+# TopLevel
+class TopLevelCommand(Command):
+    """
+    AySA, Utilidad para la gestión de despliegues sobre `docker`.
 
-    # TopLevel
-    class TopLevelCommand(Command):
-        """
-        AySA, Utilidad para la gestión de despliegues sobre `docker`.
+    Usage:
+        aysa [options] COMMAND [ARGS...]
 
-        Usage:
-            aysa [options] COMMAND [ARGS...]
+    Opciones:
+        -h, --help                              Muestra la `ayuda` del programa.
+        -v, --version                           Muestra la `versión` del programa.
+        -D, --debug                             Activa el modo `debug`.
+        -V, --verbose                           Activa el modo `verbose`.
+        -O filename, --debug-output=filename    Archivo de salida para el modo `debug`.
+        -E filename, --env=filename             Archivo de configuración del entorno (`.ini`),
+                                                el mismo será buscado en la siguiente ruta
+                                                de no ser definido: `~/.aysa/config.ini`.
 
-        Opciones:
-            -h, --help                              Muestra la `ayuda` del programa.
-            -v, --version                           Muestra la `versión` del programa.
-            -D, --debug                             Activa el modo `debug`.
-            -V, --verbose                           Activa el modo `verbose`.
-            -O filename, --debug-output=filename    Archivo de salida para el modo `debug`.
-            -E filename, --env=filename             Archivo de configuración del entorno (`.ini`),
-                                                    el mismo será buscado en la siguiente ruta
-                                                    de no ser definido: `~/.aysa/config.ini`.
+    Comandos disponibles:
+        config      Lista y administra los valores de la configuración del entorno de trabajo
+                    definidos por el archivo `~/.aysa/config.ini`.
+        registry    Lista las `imágenes` y administra los `tags` del `repositorio`.
+        release     Crea las `imágenes` para los entornos de `QA/TESTING` y `PRODUCCIÓN`.
+        remote      Despliega las `imágenes` en los entornos de `DESARROLLO` y `QA/TESTING`.
 
-        Comandos disponibles:
-            config      Lista y administra los valores de la configuración del entorno de trabajo
-                        definidos por el archivo `~/.aysa/config.ini`.
-            registry    Lista las `imágenes` y administra los `tags` del `repositorio`.
-            release     Crea las `imágenes` para los entornos de `QA/TESTING` y `PRODUCCIÓN`.
-            remote      Despliega las `imágenes` en los entornos de `DESARROLLO` y `QA/TESTING`.
+    Actualización:
+        upgrade     Actualiza los comandos disponibles.
 
-        Actualización:
-            upgrade     Actualiza los comandos disponibles.
+    > Utilice `aysa COMMAND (-h|--help)` para ver la `ayuda` especifica del comando.
+    """
 
-        > Utilice `aysa COMMAND (-h|--help)` para ver la `ayuda` especifica del comando.
-        """
+    def __init__(self, command, options=None, **kwargs):
+        kwargs.setdefault('commands', {
+            'config': 'aysa_commands.config.ConfigCommand',
+            'registry': 'aysa_commands.registry.RegistryCommand',
+            'release': 'aysa_commands.registry.ReleaseCommand',
+            'remote': 'aysa_commands.remote.RemoteCommand'
+        })
+        super().__init__(command, options, **kwargs)
 
-        def __init__(self, command, options=None, **kwargs):
-            kwargs.setdefault('commands', {
-                'config': 'aysa_commands.config.ConfigCommand',
-                'registry': 'aysa_commands.registry.RegistryCommand',
-                'release': 'aysa_commands.registry.ReleaseCommand',
-                'remote': 'aysa_commands.remote.RemoteCommand'
-            })
-            super().__init__(command, options, **kwargs)
 
-
-    def main():
-        TopLevelCommand('aysa_commands', {'version': __version__}).parse()
-
-except Exception:
-    pass
+def main():
+    TopLevelCommand('aysa_commands', {'version': __version__}).parse()
@@ -3,22 +3,40 @@
 # Created: 2019/10/30
 # ~
 
+import re
 import sys
 import json
 import logging
-from copy import deepcopy
-from configparser import ConfigParser, ExtendedInterpolation
-from docopt import docopt, DocoptExit
-from importlib import import_module
-from inspect import getdoc, isclass
+from configparser import ConfigParser
+from functools import lru_cache
 from pathlib import Path
 
 ENV_FILE = '~/.aysa/config.ini'
 CONST_COMMAND = 'COMMAND'
 CONST_ARGS = 'ARGS'
+_ENV_CACHE = {}
+_COMMAND_CACHE = {}
+_DOC_CACHE = {}
+_LOG_HANDLERS = []
+_LOG_FILE_FORMATTER = logging.Formatter('%(asctime)s %(levelname)s '
+                                        '%(filename)s %(lineno)d '
+                                        '%(message)s')
+_LOG_CONSOLE_FORMATTER = logging.Formatter('[%(levelname)s] %(message)s')
+
+
+@lru_cache(maxsize=None)
+def _rx_ini_line():
+    return re.compile(r'\[(?P<section>[^\]]+)\]'
+                      r'|(?P<option>[^=:\s][^=:]*?)\s*[=:]\s*(?P<value>.*)')
+
+
+@lru_cache(maxsize=None)
+def _rx_ini_interpolation():
+    return re.compile(r'\$(?:(\$)|\{([^}]+)\})?')
 
 
 def docopt_helper(docstring, *args, **kwargs):
+    from docopt import docopt, DocoptExit
     try:
         docstring = doc_helper(docstring)
         return docopt(docstring, *args, **kwargs), docstring
@@ -27,12 +45,34 @@ def docopt_helper(docstring, *args, **kwargs):
 
 
 def doc_helper(docstring):
-    if not isinstance(docstring, str):
-        docstring = getdoc(docstring)
-    return ' \n{}\n '.format(docstring)
+    if isinstance(docstring, (str, type)):
+        key = docstring
+    elif hasattr(docstring, '__func__'):
+        key = docstring.__func__
+    elif hasattr(docstring, '__code__'):
+        key = docstring
+    else:
+        key = type(docstring)
+    value = _DOC_CACHE.get(key)
+    if value is None:
+        if not isinstance(docstring, str):
+            from inspect import getdoc
+            docstring = getdoc(docstring)
+        value = _DOC_CACHE[key] = ' \n{}\n '.format(docstring)
+    return value
+
+
+def import_helper(path):
+    value = _COMMAND_CACHE.get(path)
+    if value is None:
+        from importlib import import_module
+        mod, cls = path.rsplit('.', 1)
+        value = _COMMAND_CACHE[path] = getattr(import_module(mod), cls)
+    return value
 
 
 def env_helper(filename=None):
+    from configparser import ExtendedInterpolation
     filepath = Path(filename or ENV_FILE).expanduser()
     parser = ConfigObject(interpolation=ExtendedInterpolation())
     if parser.read(filepath, encoding='utf-8'):
@@ -42,6 +82,90 @@ def env_helper(filename=None):
                       '`registry`, `development` y `quality`.')
 
 
+def env_read_helper(filename=None):
+    filepath = Path(filename or ENV_FILE).expanduser()
+    try:
+        mtime = filepath.stat().st_mtime_ns
+        hit = _ENV_CACHE.get(filepath)
+        if hit is not None and hit[0] == mtime:
+            return hit[1], filepath
+        data = ini_helper(filepath.read_text(encoding='utf-8'))
+    except (OSError, UnicodeDecodeError):
+        mtime, data = None, None
+    if data is None:
+        parser, filepath = env_helper(filepath)
+        data = parser.to_dict()
+    if mtime is not None:
+        _ENV_CACHE[filepath] = (mtime, data)
+    return data, filepath
+
+
+def ini_helper(text):
+    """
+    Lector rápido para archivos `.ini` simples (secciones, `clave = valor`
+    e interpolación `${sección:clave}`). Retorna `None` ante cualquier
+    construcción que no soporte, para delegar en `ConfigParser`.
+    """
+    sections, current = {}, None
+    for line in text.splitlines():
+        value = line.strip()
+        if not value or value[0] in '#;':
+            continue
+        match = _rx_ini_line().fullmatch(value)
+        if match is None or line[0].isspace():
+            return None
+        if match.group('section') is not None:
+            if match.group('section') in sections:
+                return None
+            current = sections[match.group('section')] = {}
+        elif current is None:
+            return None
+        else:
+            option = match.group('option').lower()
+            if option in current:
+                return None
+            current[option] = match.group('value')
+    defaults = sections.pop('DEFAULT', {})
+    for sv in sections.values():
+        for k, v in defaults.items():
+            sv.setdefault(k, v)
+    if defaults:
+        sections = dict({'DEFAULT': defaults}, **sections)
+    try:
+        return AttrDict({
+            sk: AttrDict({k: _ini_interpolate(sections, sk, v)
+                          for k, v in sv.items()})
+            for sk, sv in sections.items()
+            if sk != 'common' and sv
+        })
+    except (KeyError, ValueError):
+        return None
+
+
+def _ini_interpolate(sections, section, value, depth=1):
+    if '$' not in value:
+        return value
+    if depth > 10:
+        raise ValueError(value)
+
+    def replace(match):
+        if match.group(1) is not None:
+            return '$'
+        if match.group(2) is None:
+            raise ValueError(value)
+        path = match.group(2).split(':')
+        if len(path) == 1:
+            sk, option = section, path[0]
+        elif len(path) == 2:
+            sk, option = path
+        else:
+            raise ValueError(value)
+        raw = sections[sk][option.lower()]
+        return _ini_interpolate(sections, sk, raw, depth + 1)
+
+    return _rx_ini_interpolation().sub(replace, value)
+
+
 def is_yes(value):
     return str(value).lower() in ('true', 'yes', 'si', 'y', 's', '1')
 
@@ -54,37 +178,30 @@ class AttrDict(dict):
 
 class ConfigObject(ConfigParser):
     def to_dict(self):
-        result = {}
-        for sk, sv in self.items():
-            if sk == 'common':
-                continue
-            for svk, svv in sv.items():
-                if sk not in result:
-                    result[sk] = AttrDict()
-                result[sk][svk] = svv
-        return AttrDict(result)
+        return AttrDict({
+            sk: AttrDict(sv)
+            for sk, sv in self.items()
+            if sk != 'common' and sv
+        })
 
 
 class Printer:
     def __init__(self, output=None):
         self.output = output or sys.stdout
 
-    def _parse(self, *values, sep=' ', end='\n', endx=None, **kwargs):
-        tmpl = kwargs.pop('tmpl', None)
+    def _parse(self, *values, sep=' ', end='\n', endx=None, tmpl=None,
+               lower=False, upper=False, title=False, tab=0, **kwargs):
         value = tmpl.format(*values) if tmpl is not None \
-            else sep.join([str(x) for x in values])
-        if kwargs.pop('lower', False):
-            value = value.lower()
-        if kwargs.pop('upper', False):
-            value = value.upper()
-        if kwargs.pop('title', False):
-            value = value.title()
+            else sep.join(map(str, values))
+        case = 'title' if title else 'upper' if upper \
+            else 'lower' if lower else None
+        if case is not None:
+            value = getattr(value, case)()
         if endx is not None:
             end = '\n' * (endx or 1)
         if end and not value.endswith(end):
             end = '\n'
-        tab = ' ' * kwargs.pop('tab', 0)
-        return tab + value + end
+        return ' ' * tab + value + end
 
     def done(self):
         self.flush('Done.', endx=3)
@@ -134,6 +251,11 @@ class Printer:
             self.write(*values, **kwargs)
         self.output.flush()
 
+    def raw(self, value):
+        if value:
+            self.output.write(value)
+        self.flush()
+
     def json(self, value, indent=2):
         raw = json.dumps(value, indent=indent) \
               if isinstance(value, dict) else '-'
@@ -151,6 +273,8 @@ class Command:
         self._env = None
         self._output = Printer()
         self._parent = kwargs.pop('parent', None)
+        self._top_level = self._parent._top_level \
+            if self._parent is not None else self
         self._logger = kwargs.pop('logger', None)
         self.commands = kwargs.pop('commands', None)
 
@@ -159,17 +283,7 @@ class Command:
 
     @property
     def top_level(self):
-        value = None
-        while 1:
-            if self.parent is None:
-                return self
-            elif value is None:
-                value = self.parent
-            elif value.parent is not None:
-                value = value.parent
-            else:
-                break
-        return value
+        return self._top_level
 
     @property
     def parent(self):
@@ -201,7 +315,7 @@ class Command:
 
     @property
     def env_copy(self):
-        return deepcopy(self.env)
+        return AttrDict({k: AttrDict(v) for k, v in self.env.items()})
 
     @property
     def env_file(self):
@@ -229,21 +343,24 @@ class Command:
 
         root = logging.getLogger()
 
+        while _LOG_HANDLERS:
+            handler = _LOG_HANDLERS.pop()
+            root.removeHandler(handler)
+            handler.close()
+
         if self.debug_output:
-            file_formatter = logging.Formatter('%(asctime)s %(levelname)s '
-                                               '%(filename)s %(lineno)d '
-                                               '%(message)s')
             file_handler = logging.FileHandler(self.debug_output, 'w')
-            file_handler.setFormatter(file_formatter)
+            file_handler.setFormatter(_LOG_FILE_FORMATTER)
             file_handler.setLevel(logging.DEBUG)
             root.addHandler(file_handler)
+            _LOG_HANDLERS.append(file_handler)
             level = logging.ERROR
 
-        console_formatter = logging.Formatter('[%(levelname)s] %(message)s')
         console_handler = logging.StreamHandler(sys.stderr)
-        console_handler.setFormatter(console_formatter)
+        console_handler.setFormatter(_LOG_CONSOLE_FORMATTER)
         console_handler.setLevel(level)
         root.addHandler(console_handler)
+        _LOG_HANDLERS.append(console_handler)
         root.setLevel(logging.DEBUG)
 
     def parse(self, argv=None, *args, **kwargs):
@@ -264,6 +381,7 @@ class Command:
         except NoSuchCommand:
             raise CommandExit(doc)
 
+        from inspect import isclass
         try:
             if isclass(scmd):
                 sargs = arg[1:] if len(arg) > 1 else []
@@ -287,18 +405,17 @@ class Command:
         self.done()
 
     def find_command(self, command):
-        try:
-            cmd = getattr(self, 'commands')[command]
-            if isinstance(cmd, str):
-                mod, cls = cmd.rsplit('.', 1)
-                return getattr(import_module(mod), cls)
+        cmd = (self.commands or {}).get(command)
+        if isinstance(cmd, str):
+            try:
+                cmd = import_helper(cmd)
+            except (ImportError, AttributeError) as e:
+                self.logger.debug(e)
+                cmd = None
+        if cmd is None and isinstance(command, str):
+            cmd = getattr(self, command, None)
+        if cmd is not None:
             return cmd
-        except Exception as e:
-            self.logger.debug(e)
-        try:
-            return getattr(self, command)
-        except Exception as e:
-            self.logger.debug(e)
         raise NoSuchCommand(command)
 
     def __call__(self, argv=None, *args, **kwargs):
@@ -343,8 +460,7 @@ class Command:
         return True
 
     def env_load(self):
-        env, _ = env_helper(self.env_file)
-        self.env = env.to_dict()
+        self.env, _ = env_read_helper(self.env_file)
         self.logger.info('env load: %s', self.env)
 
     def env_save(self, data=None):
@@ -353,6 +469,7 @@ class Command:
         with filepath.open('w') as output:
             env.write(output)
             self.logger.info('env save: %s', env.to_dict())
+        _ENV_CACHE[filepath] = (filepath.stat().st_mtime_ns, env.to_dict())
         self.env_load()
 
     def done(self):
@@ -8,32 +8,38 @@
 ###############################################################################
 # TODO (0608156): implementar autenticación por token.
 #                 https://docs.docker.com/registry/configuration/#auth
-# TODO (0608156): implementar un paginador para el catálogo y tags dentro de
-#                 la api
 
 import re
 import json
-import requests
-from requests.auth import HTTPBasicAuth
+import threading
+from functools import lru_cache
 
+NAME_UNKNOWN = 'NAME_UNKNOWN'
+PAGE_SIZE = 100
+CATALOG_PAGE_SIZE = 1000
 TAG_SEP = ':'
 REPO_SEP = '/'
 MANIFEST_VERSION = 'v2'
+TOKEN_EXCLUDE = '|#@'
+TOKEN_TABLE = str.maketrans('', '', TOKEN_EXCLUDE)
 MEDIA_TYPES = {
     'v1': 'application/vnd.docker.distribution.manifest.v1+json',
     'v2': 'application/vnd.docker.distribution.manifest.v2+json',
     'v2f': 'application/vnd.docker.distribution.manifest.list.v2+json'
 }
+PULL_HEADERS = {k: {'Accept': v} for k, v in MEDIA_TYPES.items()}
+PUSH_HEADERS = {k: {'Accept': '*/*', 'Content-Type': v}
+                for k, v in MEDIA_TYPES.items()}
 
-rx_schema = re.compile(r'(localhost|.*\.local(?:host)?(?::\d{1,5})?)$', re.I)
-rx_registry = re.compile(r'^(localhost|[\w\-]+(\.[\w\-]+)+)(?::\d{1,5})?/',
-                         re.I)
-rx_repository = re.compile(r'^[a-z0-9]+(?:[/:._-][a-z0-9]+)*$')
 
+@lru_cache(maxsize=None)
+def _rx_registry():
+    return re.compile(r'^(localhost|[\w\-]+(\.[\w\-]+)+)(?::\d{1,5})?/', re.I)
 
-def get_media_type(value=MANIFEST_VERSION, key='Accept', obj=True):
-    value = MEDIA_TYPES[value if value in MEDIA_TYPES else MANIFEST_VERSION]
-    return {key: value} if obj is True else value
+
+@lru_cache(maxsize=None)
+def _rx_repository():
+    return re.compile(r'^[a-z0-9]+(?:[/:._-][a-z0-9]+)*$')
 
 
 def remove_registry(value):
@@ -66,35 +72,57 @@ def get_image(value):
 
 
 def get_registry(value):
-    r = rx_registry.match(value)
+    r = _rx_registry().match(value)
     if r is not None:
         return r.group()
     return None
 
 
+@lru_cache(maxsize=4096)
 def get_parts(value):
     """
     Formato del string:
       - {url:port}/{namespace}/{repository}:{tag}
     """
-    if not rx_repository.match(get_repository(value)):
+    registry = get_registry(value)
+    remainder = value[len(registry):] if registry is not None else value
+    repository, sep, tag = remainder.rpartition(TAG_SEP)
+    if not sep:
+        repository, tag = remainder, None
+    if not _rx_repository().match(repository):
         raise RegistryError('El endpoint "{}" está mal formateado.'
                             .format(value))
+    namespace, sep, image = repository.rpartition(REPO_SEP)
     return {
-        'registry': get_registry(value),
-        'repository': get_repository(value),
-        'namespace': get_namespace(value),
-        'image': get_image(value),
-        'tag': get_tag(value),
+        'registry': registry,
+        'repository': repository,
+        'namespace': namespace if sep else None,
+        'image': image,
+        'tag': tag,
     }
 
 
-def validate_token(value, exclude='|#@'):
-    return value and ''.join([x for x in value if x not in exclude]) == value
+def validate_token(value, exclude=TOKEN_EXCLUDE):
+    if not value:
+        return False
+    table = TOKEN_TABLE if exclude == TOKEN_EXCLUDE \
+        else str.maketrans('', '', exclude)
+    return value.translate(table) == value
+
+
+def get_next_page(response):
+    url = response.links.get('next', {}).get('url')
+    if not url:
+        return None
+    from urllib.parse import urlsplit, parse_qsl
+    return dict(parse_qsl(urlsplit(url).query))
 
 
 def scheme(endpoint):
-    return 'http' if rx_schema.match(endpoint) else 'https'
+    host = endpoint.split(':', 1)[0].lower()
+    if host == 'localhost' or host.endswith(('.local', '.localhost')):
+        return 'http'
+    return 'https'
 
 
 class Registry:
@@ -106,6 +134,9 @@ class Registry:
         self.verify = verify if insecure is False else True
         self.scheme = scheme(host) if insecure is False else 'http'
         self.credentials = credentials
+        self.timeout = kwargs.get('timeout', 10)
+        self._session = None
+        self._session_lock = threading.Lock()
 
     def get_baseurl(self):
         return '{}://{}/v2'.format(self.scheme, self.host)
@@ -115,28 +146,47 @@ class Registry:
             return self.credentials.split(':')
         return self.credentials
 
-    def session(self, headers=None, timeout=10):
-        s = requests.Session()
-        if self.credentials is not None:
-            s.auth = HTTPBasicAuth(*self.get_credentials(True))
-        s.headers.update(headers or {})
-        s.headers['User-Agent'] = 'AySA-Command-Line-Tool'
-        s.verify = self.verify
-        s.timeout = timeout
-        return s
+    def session(self):
+        if self._session is None:
+            with self._session_lock:
+                if self._session is None:
+                    import requests
+                    from requests.adapters import HTTPAdapter
+                    from requests.auth import HTTPBasicAuth
+                    s = requests.Session()
+                    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=32,
+                                          max_retries=0)
+                    s.mount('http://', adapter)
+                    s.mount('https://', adapter)
+                    if self.credentials is not None:
+                        s.auth = HTTPBasicAuth(*self.get_credentials(True))
+                    s.headers['User-Agent'] = 'AySA-Command-Line-Tool'
+                    s.verify = self.verify
+                    self._session = s
+        return self._session
+
+    def close(self):
+        if self._session is not None:
+            self._session.close()
+            self._session = None
 
     def request(self, method, *args, **kwargs):
-        headers = kwargs.pop('headers', {})
-        with self.session(headers) as req:
-            response = req.request(method, *args, **kwargs)
+        from requests import HTTPError
+        kwargs.setdefault('timeout', self.timeout)
+        response = self.session().request(method, *args, **kwargs)
+        try:
+            response.raise_for_status()
+        except HTTPError:
             try:
-                response.raise_for_status()
-            except requests.HTTPError:
                 data = response.json()
-                if 'errors' in data:
-                    error = data['errors'][0]
-                    raise RegistryError('{code}: {message}'.format(**error))
-            return response
+            except ValueError:
+                raise RegistryError('{}: {}'.format(response.status_code,
+                                                    response.reason))
+            if 'errors' in data:
+                error = data['errors'][0]
+                raise RegistryError('{code}: {message}'.format(**error),
+                                    error.get('code'))
+        return response
 
 
 class Entity:
@@ -169,33 +219,37 @@ class Entity:
 
 class IterEntity(Entity):
     response_key = None
-    response_data = None
+    page_size = PAGE_SIZE
 
     def __init__(self, client, prefix_filter=None):
         self.client = client
         self.prefix_filter = prefix_filter
 
-    def get(self, *args, **kwargs):
-        response_data = self.json('GET', *args, **kwargs)
-        if self.response_key not in response_data:
-            raise RegistryError('La clave "{}" no se encuentra dentro de la '
-                                'respuesta.'.format(self.response_key))
-        self.response_data = response_data[self.response_key]
+    def pages(self, *args, **kwargs):
+        params = {'n': self.page_size}
+        while params is not None:
+            response = self.request('GET', *args, params=params, **kwargs)
+            response_data = response.json()
+            if self.response_key not in response_data:
+                raise RegistryError('La clave "{}" no se encuentra dentro de '
+                                    'la respuesta.'.format(self.response_key))
+            yield response_data[self.response_key] or []
+            params = get_next_page(response)
 
     def __iter__(self):
-        if self.response_data is None:
-            self.get()
-
-        for item in self.response_data:
-            if self.prefix_filter and not item.startswith(self.prefix_filter):
-                continue
-            yield item
+        for page in self.pages():
+            for item in page:
+                if self.prefix_filter \
+                        and not item.startswith(self.prefix_filter):
+                    continue
+                yield item
 
 
 class Catalog(IterEntity):
     url = '/_catalog'
     methods_supported = 'GET'
     response_key = 'repositories'
+    page_size = CATALOG_PAGE_SIZE
 
 
 class Tags(IterEntity):
@@ -218,12 +272,10 @@ class SlimManifest(Entity):
         self.set_url(name=name, reference=reference)
 
     def request(self, method, *args, **kwargs):
-        headers = kwargs.pop('headers', {})
-        media_type = get_media_type(self.media_type, obj=False)
-        update = {'Accept': '*/*', 'Content-Type': media_type} \
-            if method in ('PUT', 'DELETE') else {'Accept': media_type}
-        headers.update(update)
-        kwargs['headers'] = headers
+        media = PUSH_HEADERS if method in ('PUT', 'DELETE') else PULL_HEADERS
+        update = media.get(self.media_type, media[MANIFEST_VERSION])
+        headers = kwargs.pop('headers', None)
+        kwargs['headers'] = dict(headers, **update) if headers else update
         return super().request(method, *args, **kwargs)
 
 
@@ -243,8 +295,12 @@ class Api:
     def tags(self, name, prefix_filter=None):
         return Tags(self.registry, name, prefix_filter)
 
+    def close(self):
+        self.registry.close()
+
     def put_tag(self, name, reference, target):
-        return self.put_manifest(name, target, self.manifest(name, reference))
+        raw = self.get_manifest(name, reference).content
+        return self.put_manifest(name, target, raw)
 
     def delete_tag(self, name, reference):
         return self.del_manifest(name, self.digest(name, reference))
@@ -262,8 +318,10 @@ class Api:
                    .request('GET', **kwargs)
 
     def put_manifest(self, name, reference, manifest, **kwargs):
+        key = 'data' if isinstance(manifest, bytes) else 'json'
+        kwargs[key] = manifest
         return self._manifest(name, reference)\
-                   .request('PUT', json=manifest, **kwargs)
+                   .request('PUT', **kwargs)
 
     def del_manifest(self, name, reference, **kwargs):
         return self._manifest(name, reference)\
@@ -275,17 +333,28 @@ class Api:
 
 
 class Image:
-    registry = None
-    repository = None
-    namespace = None
-    image = None
-    tag = None
+    __slots__ = ('registry', 'repository', 'namespace', 'image', 'tag',
+                 'value')
 
     def __init__(self, value):
         for k, v in get_parts(value).items():
             setattr(self, k, v)
         self.value = value
 
+    @classmethod
+    def with_parts(cls, registry, repository, tag=None):
+        self = cls.__new__(cls)
+        namespace, sep, image = repository.rpartition(REPO_SEP)
+        self.registry = registry
+        self.repository = repository
+        self.namespace = namespace if sep else None
+        self.image = image
+        self.tag = tag
+        self.value = '{}{}'.format(registry or '', repository)
+        if tag is not None:
+            self.value += TAG_SEP + tag
+        return self
+
     @property
     def image_tag(self):
         return '{}:{}'.format(self.repository, self.tag)
@@ -348,4 +417,6 @@ class Manifest:
 
 
 class RegistryError(Exception):
-    pass
+    def __init__(self, message, code=None):
+        super().__init__(message)
+        self.code = code
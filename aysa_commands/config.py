@@ -34,16 +34,19 @@ class ConfigCommand(Command):
         if not self.env:
             raise ValueError('La configuración del entorno está vacía.')
         sections_filter = kwargs['section']
-        self.output.blank()
+        title, write, blank = \
+            self.output.title, self.output.write, self.output.blank
+        blank()
         for s, sv in self.env.items():
             if sections_filter and s not in sections_filter:
                 continue
-            self.output.title(s, tmpl='[{}]:', upper=True)
+            title(s, tmpl='[{}]:', upper=True)
             for k, v in sv.items():
                 if k == CREDENTIALS and v:
-                    v = '{}:******'.format(v.split(':')[0])
-                self.output.write(k, v, tmpl='{} = "{}"', tab=2)
-            self.output.blank()
+                    i = v.find(':')
+                    v = (v[:i] if i >= 0 else v) + ':******'
+                write(k, v, tmpl='{} = "{}"', tab=2)
+            blank()
 
     def update(self, **kwargs):
         """
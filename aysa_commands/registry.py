@@ -3,10 +3,14 @@
 # Created: 2019/10/18
 # ~
 
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
 from aysa_commands import Command
-from aysa_commands._docker import Api, Image
+from aysa_commands._docker import Api, Image, RegistryError, NAME_UNKNOWN, \
+    get_parts
 
 WILDCARD = '*'
+MAX_WORKERS = 16
 
 
 class _RegistryCommand(Command):
@@ -18,19 +22,27 @@ class _RegistryCommand(Command):
             self._registry_api = Api(**self.env.registry)
         return self._registry_api
 
+    def on_finish(self, *args, **kwargs):
+        if self._registry_api is not None:
+            self._registry_api.close()
+            self._registry_api = None
+
     @property
     def namespace(self):
         return self.env.registry.namespace
 
     def _fix_image_name(self, value, namespace=None):
-        value = value.strip()
         namespace = namespace or self.namespace
-        return '{}/{}'.format(namespace, value) \
-            if not value.startswith(namespace) else value
+        value = value.strip()
+        if not namespace:
+            return value
+        return value if value.startswith(namespace + '/') \
+            else '{}/{}'.format(namespace, value)
 
     def _fix_images_list(self, values, namespace=None):
         values = values.split(',') if isinstance(values, str) else values or []
-        return [self._fix_image_name(x.strip(), namespace) for x in values]
+        namespace = namespace or self.namespace
+        return [self._fix_image_name(x, namespace) for x in values]
 
     def _fix_tags_list(self, values):
         if not values or values == WILDCARD:
@@ -38,20 +50,48 @@ class _RegistryCommand(Command):
         values = values.split(',') if not isinstance(values, list) else values
         return [x.strip() for x in values]
 
+    def _tags(self, repository, skip_errors=False):
+        try:
+            return list(self.api.tags(repository))
+        except RegistryError as e:
+            if not skip_errors or e.code != NAME_UNKNOWN:
+                raise
+            self.logger.debug('list repository: %s, error: %s', repository, e)
+            return []
+
+    def _valid_repository(self, value):
+        try:
+            return get_parts(value)['repository'] == value
+        except RegistryError as e:
+            self.logger.debug('list repository: %s, error: %s', value, e)
+            return False
+
     def _list(self, filter_repos=None, filter_tags=None, **kwargs):
+        for x, y in self._list_pairs(filter_repos, filter_tags, **kwargs):
+            yield Image.with_parts(None, x, y)
+
+    def _list_pairs(self, filter_repos=None, filter_tags=None, **kwargs):
         filter_repos = self._fix_images_list(filter_repos)
         filter_tags = self._fix_tags_list(filter_tags)
-        for x in self.api.catalog():
-            if (self.namespace and not x.startswith(self.namespace)) \
-                    or (filter_repos and x not in filter_repos):
-                continue
-            if filter_tags:
-                for y in self.api.tags(x):
+        if filter_tags != WILDCARD:
+            filter_tags = frozenset(filter_tags)
+        api = self.api
+        repos = dict.fromkeys(filter(self._valid_repository, filter_repos)) \
+            if filter_repos else api.catalog()
+        namespace = self.namespace
+        prefix = namespace + '/' if namespace else None
+        repos = [x for x in repos if not prefix or x.startswith(prefix)]
+        if not filter_tags:
+            for x in repos:
+                yield x, None
+            return
+        fetch = partial(self._tags, skip_errors=bool(filter_repos))
+        with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+            for x, tags in zip(repos, executor.map(fetch, repos)):
+                for y in tags:
                     if filter_tags != WILDCARD and y not in filter_tags:
                         continue
-                    yield Image('{}:{}'.format(x, y))
-            else:
-                yield Image(x)
+                    yield x, y
 
 
 class RegistryCommand(_RegistryCommand):
@@ -86,18 +126,30 @@ class RegistryCommand(_RegistryCommand):
         detail = kwargs.get('--detail', False)
         manifest = kwargs.get('--manifest', False)
         env = self.env.registry
-        self.output.head(env.host, env.namespace, tmpl='[REGISTRY]: {}/{}:',
-                         title=False)
-        for x in self._list(kwargs['image'], kwargs['--filter-tags']):
-            self.output.bullet(x.repository, x.tag, tmpl='{}:{}')
-            if detail or manifest:
-                m = self.api.manifest(x.repository, x.tag, True, True)
-                if detail and not manifest:
-                    self.output.write('created', m.created, tmpl=tmpl)
-                    d = self.api.digest(x.repository, x.tag)
-                    self.output.write('digest', d, tmpl=tmpl)
-                elif manifest:
-                    self.output.json(m.history)
+        output = self.output
+        output.head(env.host, env.namespace, tmpl='[REGISTRY]: {}/{}:',
+                    title=False)
+        filters = (kwargs['image'], kwargs['--filter-tags'])
+        if not (detail or manifest):
+            for x, y in self._list_pairs(*filters):
+                output.bullet(x, y, tmpl='{}:{}')
+            return
+        images = list(self._list(*filters))
+        fetch = partial(self._detail, digest=not manifest)
+        with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+            for x, (m, d) in zip(images, executor.map(fetch, images)):
+                output.bullet(x.repository, x.tag, tmpl='{}:{}')
+                if manifest:
+                    output.json(m.history)
+                else:
+                    output.write('created', m.created, tmpl=tmpl)
+                    output.write('digest', d, tmpl=tmpl)
+
+    def _detail(self, image, digest=True):
+        api = self.api
+        m = api.manifest(image.repository, image.tag, True, True)
+        d = api.digest(image.repository, image.tag) if digest else None
+        return m, d
 
     def tag(self, **kwargs):
         """
@@ -147,18 +199,35 @@ class ReleaseCommand(_RegistryCommand):
 
     def _release(self, source_tag, target_tag, **kwargs):
         if self.yes(**kwargs):
-            msg = 'release image: %s source: %s, target: %s'
-            for x in self._list(kwargs['image'], source_tag):
-                t = Image('{}:{}'.format(x.repository, target_tag))
-                try:
-                    rollback = '{}-rollback'.format(t.tag)
-                    self.api.put_tag(t.repository, t.tag, rollback)
-                    self.logger.info(msg, t.repository, t.tag, rollback)
-                except Exception as e:
-                    self.logger.error('Rollback imagen "%s": %s',
-                                      t.image_tag, e)
-                self.api.put_tag(x.repository, x.tag, t.tag)
-                self.logger.info(msg, x.repository, x.tag, t.tag)
+            images = list(self._list(kwargs['image'], source_tag))
+            fetch = partial(self._release_image, target_tag=target_tag)
+            with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+                for _ in executor.map(fetch, images):
+                    pass
+
+    def _release_image(self, image, target_tag):
+        api = self.api
+        msg = 'release image: %s source: %s, target: %s'
+        t = Image.with_parts(None, image.repository, target_tag)
+        try:
+            digest = api.digest(image.repository, image.tag)
+            if digest is not None \
+                    and digest == api.digest(t.repository, t.tag):
+                self.logger.info('release image: %s, skip: %s == %s',
+                                 image.repository, image.tag, t.tag)
+                return False
+        except RegistryError as e:
+            self.logger.debug('release image: %s, digest: %s',
+                              t.image_tag, e)
+        try:
+            rollback = '{}-rollback'.format(t.tag)
+            api.put_tag(t.repository, t.tag, rollback)
+            self.logger.info(msg, t.repository, t.tag, rollback)
+        except Exception as e:
+            self.logger.error('Rollback imagen "%s": %s', t.image_tag, e)
+        api.put_tag(image.repository, image.tag, t.tag)
+        self.logger.info(msg, image.repository, image.tag, t.tag)
+        return True
 
     def quality(self, **kwargs):
         """
@@ -4,35 +4,52 @@
 # ~
 
 import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from io import StringIO
 from pathlib import Path
-from functools import lru_cache
+from functools import lru_cache, partial
 from fabric import Connection
 from aysa_commands import Command
+from aysa_commands._common import Printer
 
 DEVELOPMENT = 'development'
 QUALITY = 'quality'
-rx_item = re.compile(r'^[a-z](?:[\w_])+_\d{1,3}\s{2,}[a-z0-9](?:[\w.-]+)'
-                     r'(?::\d{1,5})?/[a-z0-9](?:[\w.-/])*\s{2,}'
-                     r'(?:[a-z][\w.-]*)\s', re.I)
+CMD_SERVICES = 'docker-compose ps --services'
+CMD_IMAGES = 'docker-compose images'
+INVENTORY_SEP = '---AYSA-INVENTORY---'
+rx_container = re.compile(r'^[a-z]\w+_\d{1,3}$', re.I)
+rx_image = re.compile(r'^[a-z0-9][\w.-]+(?::\d{1,5})?/[a-z0-9][\w./-]*$',
+                      re.I)
+rx_tag = re.compile(r'^[a-z][\w.-]*$', re.I)
 rx_service = re.compile(r'^[a-z](?:[\w_])+$', re.I)
 rx_login = re.compile(r'Login\sSucceeded$', re.I)
 
 
+@lru_cache(maxsize=2048)
+def _norm_service(value, sep='_'):
+    return sep.join(value.split(sep)[1:-1])
+
+
 class _ConnectionCommand(Command):
     _stage = None
     _stages = (DEVELOPMENT, QUALITY)
-    _connection_cache = None
+
+    def on_init(self, *args, **kwargs):
+        self._connections = {}
+        self._logged_in = set()
+        self._local = threading.local()
 
     def s_close(self):
-        if self._connection_cache is not None:
-            self._connection_cache.close()
-            self._connection_cache = None
-            self._stage = None
+        while self._connections:
+            _, cnx = self._connections.popitem()
+            cnx.close()
+        self._stage = None
 
     def s_connection(self, stage=None):
-        if self._stage and stage != self._stage:
-            self.s_close()
-        if self._connection_cache is None:
+        cnx = self._connections.get(stage)
+        if cnx is None:
             env = self.env_copy[stage]
             for x in ('path', 'tag'):
                 env.pop(x, None)
@@ -40,109 +57,184 @@ class _ConnectionCommand(Command):
                 raise SystemExit('El usuario "root" no está permitido para '
                                  'ejecutar despliegues.')
             pkey = Path(env.pop('pkey', None)).expanduser()
-            env['connect_kwargs'] = {'key_filename': str(pkey)}
-            self._connection_cache = Connection(**env)
+            env['connect_kwargs'] = {'key_filename': str(pkey),
+                                     'banner_timeout': 30}
+            env['forward_agent'] = False
+            env['inline_ssh_env'] = True
+            cnx = self._connections[stage] = Connection(**env)
             self.logger.info('connection stage: %s, env: %s', stage, env)
-            self._stage = stage
-        return self._connection_cache
+        self._stage = stage
+        return cnx
 
     def on_finish(self, *args, **kwargs):
         self.s_close()
 
+    @property
+    def output(self):
+        return getattr(self._local, 'output', self._output)
+
     @property
     def cnx(self):
-        if self._stage and self._connection_cache is None:
+        if self._stage and self._stage not in self._connections:
             self.s_connection(self._stage)
-        return self._connection_cache
-
-    def run(self, command, hide=False, **kwargs):
+        return self._connections.get(self._stage)
+
+    def run(self, command, hide=False, cnx=None, **kwargs):
+        kwargs.setdefault('pty', False)
+        kwargs.setdefault('in_stream', False)
+        stream = getattr(self._local, 'stream', None)
+        if stream is not None:
+            kwargs.setdefault('out_stream', stream)
+            kwargs.setdefault('err_stream', stream)
         self.logger.info('run command: %s, kwargs: %s', command, kwargs)
-        return self.cnx.run(command, hide=hide, **kwargs)
-
-    @lru_cache()
-    def _norm_service(self, value, sep='_'):
-        return sep.join(value.split(sep)[1:-1])
+        return (cnx or self.cnx).run(command, hide=hide, **kwargs)
 
     def _list_to_str(self, values, sep=' '):
         return sep.join((x for x in values))
 
-    def _list(self, cmd, filter_line=None, obj=None):
-        response = self.run(cmd, hide=True)
-        for line in response.stdout.splitlines():
+    def _list(self, cmd, filter_line=None, obj=None, stdout=None,
+              cnx=None):
+        if stdout is None:
+            stdout = self.run(cmd, hide=True, cnx=cnx).stdout
+        for line in stdout.splitlines():
             if filter_line and not filter_line.match(line):
                 continue
             yield obj(line) if obj is not None else line
 
-    def _list_environ(self, values, cnx=True):
+    @contextmanager
+    def _environ(self, name, cnx):
+        stage = self.env[name]
+        self.output.head(name.upper(), stage.user, stage.host,
+                         tmpl='[{}]: {}@{}', title=False)
+        with cnx.cd('' if stage.user == '0x00' else stage.path):
+            yield stage
+        self.output.blank()
+
+    def _list_environ(self, values, connect=True):
         environs = [x for x in self._stages if values.get('--' + x, False)]
         for x in environs or (DEVELOPMENT,):
-            if cnx is True:
-                self.s_connection(x)
-            stage = self.env[self._stage]
-            self.output.head(x.upper(), stage.user, stage.host,
-                             tmpl='[{}]: {}@{}', title=False)
-            with self.cnx.cd('' if stage.user == '0x00' else stage.path):
-                yield x
-            self.output.blank()
-
-    def _list_service(self, values=None, **kwargs):
-        for x in self._list("docker-compose ps --services", rx_service):
+            cnx = self.s_connection(x) if connect is True else self.cnx
+            with self._environ(self._stage, cnx) as stage:
+                yield x, cnx, stage
+
+    def _each_environ(self, values, func):
+        environs = [x for x in self._stages if values.get('--' + x, False)]
+        if len(environs) < 2:
+            for _, cnx, _ in self._list_environ(values):
+                func(cnx)
+            return
+        jobs = [(x, self.s_connection(x)) for x in environs]
+        error = None
+        with ThreadPoolExecutor(max_workers=len(jobs)) as executor:
+            futures = [executor.submit(self._environ_job, x, cnx, func)
+                       for x, cnx in jobs]
+            for future in futures:
+                text, e = future.result()
+                self.output.raw(text)
+                error = error or e
+        if error is not None:
+            raise error
+
+    def _environ_job(self, name, cnx, func):
+        buffer = StringIO()
+        self._local.output = Printer(buffer)
+        self._local.stream = buffer
+        try:
+            with self._environ(name, cnx):
+                func(cnx)
+            return buffer.getvalue(), None
+        except BaseException as e:
+            return buffer.getvalue(), e
+        finally:
+            del self._local.output, self._local.stream
+
+    def _list_service(self, values=None, stdout=None, cnx=None, **kwargs):
+        for x in self._list(CMD_SERVICES, rx_service, stdout=stdout, cnx=cnx):
             if values and x not in values:
                 continue
             yield x
 
-    def _list_image(self, values, **kwargs):
-        for line in self._list("docker-compose images", rx_item):
-            container, image, tag = line.split()[:3]
-            if values and self._norm_service(container) not in values:
+    def _list_image(self, values, stdout=None, cnx=None, **kwargs):
+        for line in self._list(CMD_IMAGES, stdout=stdout, cnx=cnx):
+            parts = line.split(None, 3)
+            if len(parts) < 3 or not rx_container.match(parts[0]):
+                continue
+            container, image, tag = parts[:3]
+            if not rx_image.match(image) or not rx_tag.match(tag):
+                continue
+            if values and _norm_service(container) not in values:
                 continue
             yield '{}:{}'.format(image, tag)
 
-    def _services(self, values):
+    def _services(self, values, cnx=None):
         if isinstance(values, dict):
             values = values['service']
-        return set([x for x in self._list_service(values)])
+        return frozenset(self._list_service(values, cnx=cnx))
 
-    def _images(self, values):
+    def _inventory(self, values=None, cnx=None):
         if isinstance(values, dict):
-            values = values['image']
-        return set([x for x in self._list_image(values)])
-
-    def _login(self):
+            values = values['service']
+        cmd = '{} && echo {} && {}'.format(CMD_SERVICES, INVENTORY_SEP,
+                                           CMD_IMAGES)
+        stdout = self.run(cmd, hide=True, cnx=cnx).stdout
+        services_out, _, images_out = stdout.partition(INVENTORY_SEP)
+        services = tuple(dict.fromkeys(self._list_service(values,
+                                                          services_out)))
+        images = tuple(dict.fromkeys(self._list_image(services, images_out)))
+        return services, images
+
+    def _login(self, cnx=None):
         try:
+            cnx = cnx or self.cnx
             env = self.env.registry
-            crd = env.credentials.split(':')
-            cmd = 'docker login -u {} -p {} {}'.format(*crd, env.host)
-            res = rx_login.match(self.run(cmd, hide=True).stdout) is not None
+            key = (cnx.host, env.host)
+            if key in self._logged_in:
+                return True
+            username, _, password = env.credentials.partition(':')
+            cmd = 'docker login -u {} --password-stdin {}'\
+                  .format(username, env.host)
+            response = self.run(cmd, hide=True, cnx=cnx,
+                                in_stream=StringIO(password + '\n'))
+            res = rx_login.match(response.stdout) is not None
             self.logger.info('login registry: %s, username: %s, status: %s',
-                             env.host, crd[0], res)
+                             env.host, username, res)
+            if res:
+                self._logged_in.add(key)
             return res
         except Exception as e:
             self.logger.error('login error: %s ', e)
             return False
 
-    def _deploy(self, **kwargs):
-        if self._login():
-            self.run('docker-compose stop')
-            services = self._services(kwargs)
-            images = self._images(services)
+    def _deploy(self, cnx=None, **kwargs):
+        if self._login(cnx):
+            self.run('docker-compose stop', cnx=cnx)
+            services, images = self._inventory(kwargs, cnx)
+            cmds = []
             if services:
                 srv = self._list_to_str(services)
-                self.run('docker-compose rm -fsv {}'.format(srv))
+                cmds.append('docker-compose rm -fsv {}'.format(srv))
             if images:
                 srv = self._list_to_str(images)
-                self.run('docker rmi -f {}'.format(srv))
-            self.run('docker volume prune -f')
-            if kwargs.pop('--update', False) is True:
-                self.run('git reset --hard')
-                self.run('git pull --rebase --stat')
-            self.run('docker-compose up -d --remove-orphans')
+                cmds.append('docker rmi -f {}'.format(srv))
+            cmds.append('docker volume prune -f')
+            self.run(' && '.join(cmds), cnx=cnx)
+            if kwargs.get('--update', False) is True:
+                self.run('git reset --hard', cnx=cnx)
+                self.run('git pull --rebase --stat', cnx=cnx)
+            self.run('docker-compose up -d --remove-orphans', cnx=cnx)
         else:
             raise SystemExit('No se pudo establecer la sesión '
                              'con la `registry`.')
 
-    def _run_cmd(self, cmd, values):
-        self.run('{} {}'.format(cmd, self._list_to_str(values)))
+    def _run_cmd(self, cmd, values, cnx=None):
+        self.run('{} {}'.format(cmd, self._list_to_str(values)), cnx=cnx)
+
+    def _run_cmds(self, cmds, cnx=None):
+        for cmd in cmds:
+            self.run(cmd, cnx=cnx)
+
+    def _run_services(self, cmd, values, cnx=None):
+        self._run_cmd(cmd, self._services(values, cnx), cnx)
 
 
 class RemoteCommand(_ConnectionCommand):
@@ -180,8 +272,7 @@ class RemoteCommand(_ConnectionCommand):
             -y, --yes            Responde "SI" a todas las preguntas.
         """
         if self.yes(**kwargs):
-            for _ in self._list_environ(kwargs):
-                self._deploy(**kwargs)
+            self._each_environ(kwargs, partial(self._deploy, **kwargs))
 
     def down(self, **kwargs):
         """
@@ -196,8 +287,8 @@ class RemoteCommand(_ConnectionCommand):
             -y, --yes            Responde "SI" a todas las preguntas.
         """
         if self.yes(**kwargs):
-            for _ in self._list_environ(kwargs):
-                self.run('docker-compose down -v --remove-orphans')
+            cmds = ['docker-compose down -v --remove-orphans']
+            self._each_environ(kwargs, partial(self._run_cmds, cmds))
 
     def start(self, **kwargs):
         """
@@ -212,8 +303,8 @@ class RemoteCommand(_ConnectionCommand):
             -y, --yes            Responde "SI" a todas las preguntas.
         """
         if self.yes(**kwargs):
-            for _ in self._list_environ(kwargs):
-                self._run_cmd('docker-compose start', self._services(kwargs))
+            func = partial(self._run_services, 'docker-compose start', kwargs)
+            self._each_environ(kwargs, func)
 
     def stop(self, **kwargs):
         """
@@ -228,8 +319,8 @@ class RemoteCommand(_ConnectionCommand):
             -y, --yes            Responde "SI" a todas las preguntas.
         """
         if self.yes(**kwargs):
-            for _ in self._list_environ(kwargs):
-                self._run_cmd('docker-compose stop', self._services(kwargs))
+            func = partial(self._run_services, 'docker-compose stop', kwargs)
+            self._each_environ(kwargs, func)
 
     def restart(self, **kwargs):
         """
@@ -244,8 +335,9 @@ class RemoteCommand(_ConnectionCommand):
             -y, --yes            Responde "SI" a todas las preguntas.
         """
         if self.yes(**kwargs):
-            for _ in self._list_environ(kwargs):
-                self._run_cmd('docker-compose restart', self._services(kwargs))
+            func = partial(self._run_services, 'docker-compose restart',
+                           kwargs)
+            self._each_environ(kwargs, func)
 
     def ls(self, **kwargs):
         """
@@ -258,8 +350,8 @@ class RemoteCommand(_ConnectionCommand):
             -d, --development    Entorno de `DESARROLLO`
             -q, --quality        Entorno de `QA/TESTING`
         """
-        for _ in self._list_environ(kwargs):
-            for line in self._list_service():
+        for _, cnx, _ in self._list_environ(kwargs):
+            for line in self._list_service(cnx=cnx):
                 self.output.bullet(line, tab=1)
 
     def ps(self, **kwargs):
@@ -273,8 +365,8 @@ class RemoteCommand(_ConnectionCommand):
             -d, --development    Entorno de `DESARROLLO`
             -q, --quality        Entorno de `QA/TESTING`
         """
-        for _ in self._list_environ(kwargs):
-            self.run("docker-compose ps")
+        for _, cnx, _ in self._list_environ(kwargs):
+            self.run("docker-compose ps", cnx=cnx)
 
     def config(self, **kwargs):
         """
@@ -287,8 +379,8 @@ class RemoteCommand(_ConnectionCommand):
             -d, --development    Entorno de `DESARROLLO`
             -q, --quality        Entorno de `QA/TESTING`
         """
-        for _ in self._list_environ(kwargs):
-            self.run("docker-compose config --resolve-image-digests")
+        for _, cnx, _ in self._list_environ(kwargs):
+            self.run("docker-compose config --resolve-image-digests", cnx=cnx)
 
     def prune(self, **kwargs):
         """
@@ -309,9 +401,9 @@ class RemoteCommand(_ConnectionCommand):
 --
 Desdea continuar?'''
         if self.yes(message, **kwargs):
-            for _ in self._list_environ(kwargs):
-                self.run('docker-compose down -v --rmi all --remove-orphans')
-                self.run('docker volume prune -f')
+            cmds = ['docker-compose down -v --rmi all --remove-orphans',
+                    'docker volume prune -f']
+            self._each_environ(kwargs, partial(self._run_cmds, cmds))
 
     def update(self, **kwargs):
         """
@@ -326,9 +418,8 @@ Desdea continuar?'''
             -y, --yes           Responde "SI" a todas las preguntas.
         """
         if self.yes(**kwargs):
-            for _ in self._list_environ(kwargs):
-                self.run('git reset --hard')
-                self.run('git pull --rebase --stat')
+            cmds = ['git reset --hard', 'git pull --rebase --stat']
+            self._each_environ(kwargs, partial(self._run_cmds, cmds))
 
     def cmd(self, **kwargs):
         """
@@ -342,10 +433,10 @@ Desdea continuar?'''
             -q, --quality        Entorno de `QA/TESTING`
             -y, --yes            Responde "SI" a todas las preguntas.
         """
-        for _ in self._list_environ(kwargs):
+        for _, cnx, _ in self._list_environ(kwargs):
             cmd = kwargs['cmd']
             if len(cmd) == 1:
                 cmd = cmd[0].split()
             if cmd[0] not in ('docker', 'docker-compose', 'git'):
                 continue
-            self.run(self._list_to_str(cmd))
+            self.run(self._list_to_str(cmd), cnx=cnx)
@@ -27,23 +27,9 @@ setup(
     python_requires='>=3.6.*, <4',
 
     install_requires=[
-        'bcrypt==3.1.7',
-        'certifi==2019.9.11',
-        'cffi==1.13.1',
-        'chardet==3.0.4',
-        'colorama==0.4.1',
-        'cryptography==2.8',
-        'docopt==0.6.2',
-        'fabric==2.5.0',
-        'idna==2.8',
-        'invoke==1.3.0',
-        'paramiko==2.6.0',
-        'pycparser==2.19',
-        'pynacl==1.3.0',
-        'requests==2.22.0',
-        'six==1.12.0',
-        'urllib3==1.25.6',
-        'vistir==0.4.3'
+        'docopt>=0.6.2',
+        'fabric>=2.5',
+        'requests>=2.22'
     ],
 
     classifiers=[